@@ -6,17 +6,25 @@ import getpass
 import json
 import logging
 import os
+import platform
 import re
+import shutil
 import time
 from datetime import datetime, timedelta
 from pathlib import Path
 from typing import Optional
 
 import requests
+import selenium
 from requests import Response
 from requests.adapters import HTTPAdapter
 from selenium import webdriver
-from selenium.common.exceptions import NoSuchElementException, TimeoutException
+from selenium.common.exceptions import (
+    NoSuchElementException,
+    StaleElementReferenceException,
+    TimeoutException,
+    WebDriverException,
+)
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.by import By
@@ -40,6 +48,12 @@ CREDENTIALS_ORG = "organisation"
 CREDENTIALS_UNAME = "username"
 CREDENTIALS_PW = "password"
 
+CACHE_DIR = Path.home() / ".cache" / "asvz-bot"
+
+SYSTEM_CHROMEDRIVER_PATH = "/usr/bin/chromedriver"
+CHROMEDRIVER_CACHE_FILENAME = CACHE_DIR / "chromedriver.json"
+CHROMEDRIVER_CACHE_TTL_SEC = 24 * 60 * 60
+
 ETH_ORGANISATION_NAME = "ETH Zürich"
 UZH_ORGANISATION_NAME = "Universität Zürich"
 ZHAW_ORGANISATION_NAME = "ZHAW - Zürcher Hochschule für Angewandte Wissenschaften"
@@ -57,14 +71,21 @@ ORGANISATIONS = {
     "EDUID": SWITCH_EDUID_ORGANISATION_NAME,
 }
 
+# alternative spellings accepted for organisations
+ORGANISATION_ALIASES = {
+    "EDU-ID": "EDUID",
+    "SWITCH": "EDUID",
+}
+
+# weekday index as returned by datetime.weekday()
 WEEKDAYS = {
-    "Mo": "Monday",
-    "Tu": "Tuesday",
-    "We": "Wednesday",
-    "Th": "Thursday",
-    "Fr": "Friday",
-    "Sa": "Saturday",
-    "Su": "Sunday",
+    "Mo": 0,
+    "Tu": 1,
+    "We": 2,
+    "Th": 3,
+    "Fr": 4,
+    "Sa": 5,
+    "Su": 6,
 }
 
 LEVELS = {"Alle": 2104, "Mittlere": 880, "Fortgeschrittene": 726}
@@ -87,6 +108,11 @@ FACILITIES = {
     "Bad Bungertwies": 45602,
 }
 
+ORG_CHOICES = tuple(ORGANISATIONS)
+WEEKDAY_CHOICES = tuple(WEEKDAYS)
+LEVEL_CHOICES = tuple(LEVELS)
+FACILITY_CHOICES = tuple(FACILITIES)
+
 
 class EnvVariables:
     """
@@ -114,6 +140,26 @@ class EnvVariables:
     sport_id: Optional[str] = os.environ.get("ASVZ_SPORT_ID")
     trainer: Optional[str] = os.environ.get("ASVZ_TRAINER")
 
+    # Driver values
+    disable_selenium_manager: Optional[str] = os.environ.get(
+        "ASVZ_DISABLE_SELENIUM_MANAGER"
+    )
+
+
+# argument names and the EnvVariables attributes providing their defaults
+ENV_DEFAULTS = (
+    ("organisation", "cred_organization"),
+    ("username", "cred_username"),
+    ("password", "cred_password"),
+    ("type", "enrollment_type"),
+    ("lesson_id", "lesson_id"),
+    ("weekday", "week_day"),
+    ("start_time", "start_time"),
+    ("trainer", "trainer"),
+    ("facility", "facility"),
+    ("level", "level"),
+    ("sport_id", "sport_id"),
+)
 
 logging.basicConfig(
     format="%(asctime)s %(levelname)-8s %(message)s",
@@ -124,7 +170,51 @@ logging.basicConfig(
 ISSUES_URL = "https://github.com/fbuetler/asvz-bot/issues"
 NO_SUCH_ELEMENT_ERR_MSG = f"Element on website not found! This may happen when the website was updated recently. Please report this incident to: {ISSUES_URL}"
 
-LESSON_ENROLLMENT_NUMBER_REGEX = re.compile(r".*Du\shast\sdie\sPlatz\-Nr\.\s(\d+).*")
+# locators of the elements the bot interacts with on the ASVZ and login pages
+XPATH_DAY_TEASER = (By.XPATH, "//div[@class='teaser-list-calendar__day']")
+XPATH_LESSON = (By.XPATH, ".//li[@class='btn-hover-parent']")
+XPATH_REGISTER_BTN = (
+    By.XPATH,
+    "//button[@id='btnRegister' and (@class='btn-primary btn enrollmentPlacePadding' or @class='btn btn-default')]",
+)
+XPATH_ALERT = (By.XPATH, "//div[contains(@class, 'alert')]")
+XPATH_LESSON_DETAILS = (By.XPATH, "//dl/dd")
+# only rendered for a logged in user: the register button or a notice like an existing enrollment
+XPATH_ENROLLMENT_STATE = (
+    By.XPATH,
+    "//button[@id='btnRegister'] | //app-lessons-enrollment-button//div[contains(@class, 'alert')]",
+)
+XPATH_ENROLLMENT_INTERVAL = (By.XPATH, "//dl[contains(., 'Einschreibezeitraum')]/dd")
+XPATH_ENROLLMENT_INTERVAL_FALLBACK = (
+    By.XPATH,
+    "//dl[contains(., 'Anmeldezeitraum')]/dd",
+)
+XPATH_LESSON_INTERVAL = (By.XPATH, "//dl[contains(., 'Datum/Zeit')]/dd")
+XPATH_LESSON_INTERVAL_FALLBACK = (
+    By.XPATH,
+    "//dt[contains(., 'Lektionen')]/following-sibling::dd[0]",
+)
+XPATH_LOGIN_BTN = (
+    By.XPATH,
+    "//button[@class='btn btn-default' and @title='Login'] | //a[@class='btn btn-default' and @title='Login & Anmelden']",
+)
+XPATH_SWITCHAAI_LOGIN_BTN = (
+    By.XPATH,
+    "//button[@class='btn btn-warning btn-block' and @title='SwitchAai Account Login']",
+)
+XPATH_ORGANISATION_INPUT = (By.XPATH, "//input[@id='userIdPSelection_iddtext']")
+XPATH_ASVZ_ID_INPUT = (By.XPATH, "//input[@id='AsvzId']")
+XPATH_ASVZ_PASSWORD_INPUT = (By.XPATH, "//input[@id='Password']")
+XPATH_ASVZ_SUBMIT_BTN = (By.XPATH, "//button[@type='submit' and text()='Login']")
+XPATH_USERNAME_INPUT = (By.XPATH, "//input[@id='username']")
+XPATH_PASSWORD_INPUT = (By.XPATH, "//input[@id='password']")
+XPATH_EDUID_SUBMIT_BTN = (By.XPATH, "//button[@type='submit' and @id='login-button']")
+XPATH_SUBMIT_BTN = (By.XPATH, "//button[@type='submit']")
+XPATH_FREE_PLACES = (By.XPATH, "//dl[contains(., 'Freie Plätze')]/dd/span")
+
+# extracts the start of an interval like 'Mo, 04.12.2023 10:00 - Di, 26.12.2023 23:59'
+INTERVAL_START_REGEX = re.compile(r"[^,]+,\s*(\d{1,2}\.\d{1,2}\.\d{4}\s+\d{1,2}:\d{2})")
+LESSON_ENROLLMENT_NUMBER_REGEX = re.compile(r"Du\shast\sdie\sPlatz-Nr\.\s(\d+)")
 
 
 class AsvzBotException(Exception):
@@ -136,26 +226,20 @@ class CustomHttpClient(HttpClient):
         super().__init__()
         self.proxy = proxy
 
+        # Share one session across all calls, so connections are kept alive and reused
+        self._session = requests.Session()
+        adapter = HTTPAdapter(max_retries=3, pool_connections=4, pool_maxsize=10)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        if self.proxy:
+            self._session.proxies = {"http": self.proxy, "https": self.proxy}
+
     def get(self, url, params=None, **kwargs) -> Response:
         """
         Add you own logic here like session or proxy etc.
         """
         log("The call will be done with custom HTTP client")
-
-        if self.proxy:
-            # If a proxy is provided, use it
-            session = requests.Session()
-            session.mount("http://", HTTPAdapter(max_retries=3))
-            session.mount("https://", HTTPAdapter(max_retries=3))
-            session.proxies = {"http": self.proxy, "https": self.proxy}
-            response = session.get(
-                url, params=params, **kwargs
-            )  # Use params as a keyword argument
-        else:
-            # If no proxy is provided, make a regular request
-            response = requests.get(url, params=params, **kwargs)
-
-        return response
+        return self._session.get(url, params=params, **kwargs)
 
 
 class CredentialsManager:
@@ -170,7 +254,7 @@ class CredentialsManager:
                 password = getpass.getpass("Organisation password:")
 
             self.credentials = {
-                CREDENTIALS_ORG: ORGANISATIONS[org],
+                CREDENTIALS_ORG: ORGANISATIONS[parse_organisation(org)],
                 CREDENTIALS_UNAME: uname,
                 CREDENTIALS_PW: password,
             }
@@ -179,7 +263,9 @@ class CredentialsManager:
                 "Overwriting credentials loaded from local store with arguments"
             )
             if org is not None:
-                self.credentials[CREDENTIALS_ORG] = ORGANISATIONS[org]
+                self.credentials[CREDENTIALS_ORG] = ORGANISATIONS[
+                    parse_organisation(org)
+                ]
             if uname is not None:
                 self.credentials[CREDENTIALS_UNAME] = uname
 
@@ -198,11 +284,14 @@ class CredentialsManager:
         return self.credentials
 
     def __store(self):
-        with open(CREDENTIALS_FILENAME, "w") as f:
-            json.dump(
-                self.credentials,
-                f,
-            )
+        # write to a temporary file first, so a crash never leaves a truncated store behind
+        tmp = CREDENTIALS_FILENAME + ".tmp"
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        # the mode of os.open only applies to new files, not to a leftover tmp file
+        os.fchmod(fd, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.credentials, f, separators=(",", ":"))
+        os.replace(tmp, CREDENTIALS_FILENAME)
 
     def __load(self):
         creds = Path(CREDENTIALS_FILENAME)
@@ -235,30 +324,23 @@ class AsvzEnroller:
         creds,
     ):
         today = datetime.today()
-        weekday_int = time.strptime(WEEKDAYS[weekday], "%A").tm_wday
+        weekday_int = WEEKDAYS[weekday]
         weekday_date = today + timedelta((weekday_int - today.weekday()) % 7)
         if level is not None:
             str_level = f"f[2]=niveau:{LEVELS[level]}&"
         else:
             str_level = ""
-        sport_url = (
-            f"{SPORTFAHRPLAN_BASE_URL}?"
-            + f"f[0]=sport:{sport_id}&"
-            + f"f[1]=facility:{FACILITIES[facility]}&"
-            + str_level
-            + f"date={weekday_date.year}-{weekday_date.month:02d}-{weekday_date.day:02d}%20{start_time.hour:02d}:{start_time.minute:02d}"
-        )
+        sport_url = f"{SPORTFAHRPLAN_BASE_URL}?f[0]=sport:{sport_id}&f[1]=facility:{FACILITIES[facility]}&{str_level}date={weekday_date:%Y-%m-%d}%20{start_time:%H:%M}"
         logging.info("Searching lesson on '{}'".format(sport_url))
 
-        lesson_url = None
+        enroller = None
         driver = None
         try:
             driver = AsvzEnroller.get_driver(chromedriver_path, proxy_url)
             driver.get(sport_url)
-            driver.implicitly_wait(3)
 
-            day_ele = driver.find_element(
-                By.XPATH, "//div[@class='teaser-list-calendar__day']"
+            day_ele = WebDriverWait(driver, 10).until(
+                EC.presence_of_element_located(XPATH_DAY_TEASER)
             )
 
             if trainer:
@@ -269,9 +351,7 @@ class AsvzEnroller:
                     ),
                 )
             else:
-                lesson = day_ele.find_element(
-                    By.XPATH, ".//li[@class='btn-hover-parent']"
-                )
+                lesson = day_ele.find_element(*XPATH_LESSON)
             logging.debug("Found lesson")
 
             lesson_url = lesson.find_element(
@@ -281,7 +361,6 @@ class AsvzEnroller:
 
             # When there is no lesson on the requested day, the ASVZ webpage returns the first lesson on the next day with lessons.
             driver.get(lesson_url)
-            driver.implicitly_wait(3)
             lesson_start = AsvzEnroller.__get_enrollment_and_start_time(driver)[1]
             expected_lesson_start = datetime(
                 weekday_date.year,
@@ -296,25 +375,28 @@ class AsvzEnroller:
                 )
                 exit(2)
 
-        except NoSuchElementException as e:
+            # Hand the browser over, so the enrollment does not have to start a new one
+            enroller = cls(chromedriver_path, lesson_url, creds, proxy_url, driver)
+        except (NoSuchElementException, TimeoutException) as e:
             logging.error(
                 "Lesson not found! Make sure the lesson is visible on the above URL and the name of the trainer matches."
             )
             exit(1)
         finally:
-            if driver is not None:
+            if enroller is None and driver is not None:
                 driver.quit()
 
-        return cls(chromedriver_path, lesson_url, creds)
+        return enroller
 
     @staticmethod
     def get_driver(chromedriver_path, proxy_url=None):
         options = Options()
-        options.add_argument("--private")
         options.add_argument("--disable-blink-features=AutomationControlled")
         options.add_argument("--window-size=1920,1080")   
-        options.add_argument("--disable-gpu")
         options.add_argument("--headless=new")
+        options.add_argument("--disable-extensions")
+        options.add_argument("--disable-background-networking")
+        options.add_argument("--blink-settings=imagesEnabled=false")
         options.add_argument(
             "--no-sandbox"
         )  # Required for running as root user in Docker container
@@ -322,15 +404,24 @@ class AsvzEnroller:
             "--disable-dev-shm-usage"
         )  # Required for running as root user in Docker container
         options.add_argument("user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/98.0.4758.102 Safari/537.36")
-        options.add_experimental_option("prefs", {"intl.accept_languages": "de"})
-        options.add_experimental_option("prefs", {"translate": {"enabled": False}})  # Disable automatic translation
+        # Chrome only keeps the last "prefs" option, so all preferences have to be set at once
+        options.add_experimental_option(
+            "prefs",
+            {
+                "intl.accept_languages": "de",
+                "translate": {"enabled": False},  # Disable automatic translation
+                "profile.managed_default_content_settings.images": 2,  # Do not load images
+                "profile.default_content_setting_values.notifications": 2,  # Block notifications
+            },
+        )
         if proxy_url is not None:
             options.add_argument(f"--proxy-server={proxy_url}")
 
-        return webdriver.Chrome(
-            service=Service(chromedriver_path),
-            options=options,
-        )
+        # Without an explicit path, Selenium Manager locates a matching driver
+        kwargs = {"options": options}
+        if chromedriver_path is not None:
+            kwargs["service"] = Service(chromedriver_path)
+        return webdriver.Chrome(**kwargs)
 
     @staticmethod
     def wait_until(enrollment_start):
@@ -355,11 +446,12 @@ class AsvzEnroller:
             )
             time.sleep(sleep_time)
 
-    def __init__(self, chromedriver, lesson_url, creds, proxy_url=None):
+    def __init__(self, chromedriver, lesson_url, creds, proxy_url=None, driver=None):
         self.chromedriver = chromedriver
         self.lesson_url = lesson_url
         self.creds = creds
         self.proxy_url = proxy_url
+        self._driver = driver
 
         logging.info(
             "Summary:\n\tOrganisation: {}\n\tUsername: {}\n\tPassword: {}\n\tLesson: {}".format(
@@ -370,31 +462,45 @@ class AsvzEnroller:
             )
         )
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def driver(self):
+        """
+        The browser is started on first use and shared by all steps of the enrollment.
+        """
+        if self._driver is None:
+            self._driver = AsvzEnroller.get_driver(self.chromedriver, self.proxy_url)
+        return self._driver
+
+    def close(self):
+        if self._driver is not None:
+            self._driver.quit()
+            self._driver = None
+
     def enroll(self):
         logging.info("Checking login credentials")
         try:
-            driver = AsvzEnroller.get_driver(self.chromedriver, self.proxy_url)
-            driver.get(self.lesson_url)
-            driver.implicitly_wait(3)
-            self.__organisation_login(driver)
+            driver = self.driver
+            # Both paths leave the driver on the lesson page, so the login does not reload it
+            if not self.__restore_session(driver):
+                self.__organisation_login(driver)
             (
                 self.enrollment_start,
                 self.lesson_start,
             ) = AsvzEnroller.__get_enrollment_and_start_time(driver)
-        except NoSuchElementException as e:
-            logging.error(NO_SUCH_ELEMENT_ERR_MSG)
-            raise e
-        finally:
-            if driver is not None:
-                driver.quit()
 
-        if datetime.today() < self.enrollment_start:
-            AsvzEnroller.wait_until(self.enrollment_start)
+            # Keep the authenticated browser open instead of logging in again after the sleep
+            if datetime.today() < self.enrollment_start:
+                AsvzEnroller.wait_until(self.enrollment_start)
 
-        try:
-            driver = AsvzEnroller.get_driver(self.chromedriver, self.proxy_url)
+            # The session may have expired while sleeping
             driver.get(self.lesson_url)
-            driver.implicitly_wait(3)
+            self.__organisation_login(driver)
 
             logging.info("Starting enrollment")
 
@@ -408,21 +514,26 @@ class AsvzEnroller:
 
                 logging.info("Lesson has free places")
 
-                self.__organisation_login(driver)
+                # Before the enrollment opens, wait for the register button until shortly after the start
+                timeout = 15
+                opens_in = (self.enrollment_start - datetime.today()).total_seconds()
+                if opens_in > 0:
+                    logging.info("Waiting for enrollment to open")
+                    timeout += opens_in
+                else:
+                    logging.info("Waiting for enrollment")
 
                 try:
-                    logging.info("Waiting for enrollment")
-                    WebDriverWait(driver, 5 * 60).until(
-                        EC.element_to_be_clickable(
-                            (
-                                By.XPATH,
-                                "//button[@id='btnRegister' and (@class='btn-primary btn enrollmentPlacePadding' or @class='btn btn-default')]",
-                            )
-                        )
+                    WebDriverWait(driver, timeout, poll_frequency=0.1).until(
+                        EC.element_to_be_clickable(XPATH_REGISTER_BTN)
                     ).click()
-
-                    time.sleep(5)
                 except TimeoutException as e:
+                    if opens_in > 0:
+                        logging.info(
+                            "Enrollment did not open in time. Reloading the lesson."
+                        )
+                        driver.get(self.lesson_url)
+                        continue
                     logging.info(
                         "Place was already taken in the meantime. Rechecking for available places."
                     )
@@ -431,14 +542,22 @@ class AsvzEnroller:
                 logging.info("Submitted enrollment request.")
                 enrolled = True
 
+                try:
+                    # the enrollment number is shown as soon as the request went through
+                    WebDriverWait(driver, 10).until(
+                        EC.text_to_be_present_in_element(
+                            (By.TAG_NAME, "app-lessons-enrollment-button"), "Platz-Nr"
+                        )
+                    )
+                except TimeoutException:
+                    pass
+
                 try:
                     enrollment_el = driver.find_element(
                         By.TAG_NAME, "app-lessons-enrollment-button"
                     )
 
-                    alert_el = enrollment_el.find_element(
-                        By.XPATH, "//div[contains(@class, 'alert')]"
-                    )
+                    alert_el = enrollment_el.find_element(*XPATH_ALERT)
                     alert_text = alert_el.get_attribute("innerHTML")
 
                     if "Du hast dich erfolgreich eingeschrieben" in alert_text:
@@ -451,7 +570,7 @@ class AsvzEnroller:
                     participation_el = enrollment_el.find_element(By.TAG_NAME, "span")
                     participation_text = participation_el.get_attribute("innerHTML")
 
-                    m = LESSON_ENROLLMENT_NUMBER_REGEX.match(participation_text)
+                    m = LESSON_ENROLLMENT_NUMBER_REGEX.search(participation_text)
                     if m:
                         enrollment_number = m.group(1)
                         logging.info(f"Your enrollment number is {enrollment_number}")
@@ -463,16 +582,27 @@ class AsvzEnroller:
                     logging.error("Failed to get enrollment result!")
                     raise e
 
-        except NoSuchElementException as e:
+        # the login steps wait for their elements, so a missing one surfaces as a timeout
+        except (NoSuchElementException, TimeoutException) as e:
             logging.error(NO_SUCH_ELEMENT_ERR_MSG)
             raise e
-        finally:
-            if driver is not None:
-                driver.quit()
 
     @staticmethod
     def __get_enrollment_and_start_time(driver):
         try:
+            try:
+                # wait until the lesson page is rendered
+                WebDriverWait(driver, 10).until(
+                    EC.any_of(
+                        EC.presence_of_element_located(
+                            (By.TAG_NAME, "app-page-not-found")
+                        ),
+                        EC.presence_of_element_located(XPATH_LESSON_DETAILS),
+                    )
+                )
+            except TimeoutException:
+                pass  # the lookups below report the missing element
+
             try:
                 driver.find_element(By.TAG_NAME, "app-page-not-found")
             except NoSuchElementException:
@@ -492,22 +622,23 @@ class AsvzEnroller:
     @staticmethod
     def __get_enrollment_time(driver):
         try:
-            enrollment_interval_raw = driver.find_element(
-                By.XPATH, "//dl[contains(., 'Einschreibezeitraum')]/dd"
-            )
+            enrollment_interval_raw = driver.find_element(*XPATH_ENROLLMENT_INTERVAL)
         except NoSuchElementException as e:
             # If no section called "Einschreibezeitraum" is found, look for "dl" with "Anmeldezeitraum"
             enrollment_interval_raw = driver.find_element(
-                By.XPATH, "//dl[contains(., 'Anmeldezeitraum')]/dd"
+                *XPATH_ENROLLMENT_INTERVAL_FALLBACK
             )
 
         # enrollment_interval_raw is like 'Mo, 04.12.2023 10:00 - Di, 26.12.2023 23:59'
-        enrollment_start_raw = (
-            enrollment_interval_raw.get_attribute("innerHTML")
-            .split("-")[0]
-            .split(",")[1]
-            .strip()
-        )
+        enrollment_interval = enrollment_interval_raw.text.strip()
+        m = INTERVAL_START_REGEX.match(enrollment_interval)
+        if m is None:
+            raise AsvzBotException(
+                "Failed to parse enrollment start time: '{}'".format(
+                    enrollment_interval
+                )
+            )
+        enrollment_start_raw = m.group(1)
 
         try:
             enrollment_start = datetime.strptime(enrollment_start_raw, "%d.%m.%Y %H:%M")
@@ -527,22 +658,19 @@ class AsvzEnroller:
     @staticmethod
     def __get_lesson_time(driver):
         try:
-            lesson_interval_raw = driver.find_element(
-                By.XPATH, "//dl[contains(., 'Datum/Zeit')]/dd"
-            )
+            lesson_interval_raw = driver.find_element(*XPATH_LESSON_INTERVAL)
         except NoSuchElementException:
             # If no section called "Datum/Zeit" is found, look for "dt" with "Lektionen"
-            lesson_interval_raw = driver.find_element(
-                By.XPATH, "//dt[contains(., 'Lektionen')]/following-sibling::dd[0]"
-            )
+            lesson_interval_raw = driver.find_element(*XPATH_LESSON_INTERVAL_FALLBACK)
 
         # lesson_interval_raw is like 'Mo, 10.05.2021 06:55 - 08:05'
-        lesson_start_raw = (
-            lesson_interval_raw.get_attribute("innerHTML")
-            .split("-")[0]
-            .split(",")[1]
-            .strip()
-        )
+        lesson_interval = lesson_interval_raw.text.strip()
+        m = INTERVAL_START_REGEX.match(lesson_interval)
+        if m is None:
+            raise AsvzBotException(
+                "Failed to parse lesson start time: '{}'".format(lesson_interval)
+            )
+        lesson_start_raw = m.group(1)
 
         try:
             lesson_start = datetime.strptime(lesson_start_raw, "%d.%m.%Y %H:%M")
@@ -555,15 +683,31 @@ class AsvzEnroller:
         logging.info("Lesson starts at {}".format(lesson_start.strftime("%H:%M:%S")))
         return lesson_start
 
+    @staticmethod
+    def __is_logged_in(driver):
+        """
+        Waits until the lesson page shows either a login or the enrollment state of a logged in user.
+        """
+        try:
+            WebDriverWait(driver, 20).until(
+                EC.any_of(
+                    EC.presence_of_element_located(XPATH_LOGIN_BTN),
+                    EC.presence_of_element_located(XPATH_ENROLLMENT_STATE),
+                )
+            )
+        except TimeoutException:
+            # undecided, so rather attempt a login
+            return False
+        return not driver.find_elements(*XPATH_LOGIN_BTN)
+
     def __organisation_login(self, driver):
+        if AsvzEnroller.__is_logged_in(driver):
+            logging.info("Already logged in")
+            return
+
         logging.debug("Start login process")
         WebDriverWait(driver, 20).until(
-            EC.element_to_be_clickable(
-                (
-                    By.XPATH,
-                    "//button[@class='btn btn-default' and @title='Login'] | //a[@class='btn btn-default' and @title='Login & Anmelden']",
-                )
-            )
+            EC.element_to_be_clickable(XPATH_LOGIN_BTN)
         ).click()
 
         logging.info("Login to '{}'".format(self.creds[CREDENTIALS_ORG]))
@@ -571,21 +715,15 @@ class AsvzEnroller:
             self.__organisation_login_asvz(driver)
         else:
             WebDriverWait(driver, 20).until(
-                EC.element_to_be_clickable(
-                    (
-                        By.XPATH,
-                        "//button[@class='btn btn-warning btn-block' and @title='SwitchAai Account Login']",
-                    )
-                )
+                EC.element_to_be_clickable(XPATH_SWITCHAAI_LOGIN_BTN)
             ).click()
 
 
-            organization = driver.find_element(
-                By.XPATH, "//input[@id='userIdPSelection_iddtext']"
+            organization = WebDriverWait(driver, 20).until(
+                EC.presence_of_element_located(XPATH_ORGANISATION_INPUT)
             )
             organization.send_keys("{}a".format(Keys.CONTROL))
-            organization.send_keys(self.creds[CREDENTIALS_ORG])
-            organization.send_keys(Keys.ENTER)
+            organization.send_keys(self.creds[CREDENTIALS_ORG] + Keys.ENTER)
 
             # UZH switched to Switch edu-ID login @see https://github.com/fbuetler/asvz-bot/issues/31
             if (
@@ -607,92 +745,181 @@ class AsvzEnroller:
             )
         else:
             logging.info("Valid login credentials")
+            self.__store_cookies(driver)
+
+    def __cookies_filename(self):
+        name = re.sub(
+            r"[^\w.-]",
+            "_",
+            f"{self.creds[CREDENTIALS_ORG]}-{self.creds[CREDENTIALS_UNAME]}",
+        )
+        return CACHE_DIR / f"cookies-{name}.json"
+
+    def __store_cookies(self, driver):
+        filename = self.__cookies_filename()
+        tmp = filename.with_suffix(".tmp")
+        try:
+            CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            os.fchmod(fd, 0o600)
+            with os.fdopen(fd, "w") as f:
+                json.dump(driver.get_cookies(), f)
+            os.replace(tmp, filename)
+        except OSError as e:
+            logging.warning(f"Failed to store session cookies: {e}")
+
+    def __restore_session(self, driver):
+        """
+        Opens the lesson page with the cookies of a previous login, if any. Returns whether the restored session is still valid.
+        """
+        filename = self.__cookies_filename()
+        try:
+            with open(filename, "r") as f:
+                cookies = json.load(f)
+        except (OSError, ValueError):
+            driver.get(self.lesson_url)
+            return False
+
+        logging.info("Restoring session of a previous login")
+        driver.get(LESSON_BASE_URL)
+        for cookie in cookies:
+            try:
+                driver.add_cookie(cookie)
+            except WebDriverException as e:
+                logging.debug(f"Failed to restore cookie '{cookie.get('name')}': {e}")
+
+        driver.get(self.lesson_url)
+        if AsvzEnroller.__is_logged_in(driver):
+            logging.info("Restored session is still valid")
+            return True
+
+        logging.info("Restored session has expired")
+        filename.unlink(missing_ok=True)
+        driver.delete_all_cookies()
+        return False
 
     def __organisation_login_asvz(self, driver):
-        driver.find_element(By.XPATH, "//input[@id='AsvzId']").send_keys(
-            self.creds[CREDENTIALS_UNAME]
+        fast_fill(
+            driver,
+            WebDriverWait(driver, 20).until(
+                EC.presence_of_element_located(XPATH_ASVZ_ID_INPUT)
+            ),
+            self.creds[CREDENTIALS_UNAME],
         )
-        driver.find_element(By.XPATH, "//input[@id='Password']").send_keys(
-            self.creds[CREDENTIALS_PW]
+        fast_fill(
+            driver,
+            driver.find_element(*XPATH_ASVZ_PASSWORD_INPUT),
+            self.creds[CREDENTIALS_PW],
         )
 
         WebDriverWait(driver, 20).until(
-            EC.element_to_be_clickable(
-                (
-                    By.XPATH,
-                    "//button[@type='submit' and text()='Login']",
-                )
-            )
+            EC.element_to_be_clickable(XPATH_ASVZ_SUBMIT_BTN)
         ).click()
 
     def __organisation_login_switch_eduid(self, driver):
-        driver.find_element(By.XPATH, "//input[@id='username']").send_keys(
-            self.creds[CREDENTIALS_UNAME]
+        fast_fill(
+            driver,
+            WebDriverWait(driver, 20).until(
+                EC.presence_of_element_located(XPATH_USERNAME_INPUT)
+            ),
+            self.creds[CREDENTIALS_UNAME],
         )
 
         WebDriverWait(driver, 20).until(
-            EC.element_to_be_clickable(
-                (
-                    By.XPATH,
-                    "//button[@type='submit' and @id='login-button']",
-                )
-            )
+            EC.element_to_be_clickable(XPATH_EDUID_SUBMIT_BTN)
         ).click()
 
         try:
-            driver.find_element(By.XPATH, "//input[@id='password']").send_keys(
-                self.creds[CREDENTIALS_PW]
+            fast_fill(
+                driver,
+                WebDriverWait(driver, 20).until(
+                    EC.presence_of_element_located(XPATH_PASSWORD_INPUT)
+                ),
+                self.creds[CREDENTIALS_PW],
             )
-        except NoSuchElementException:
+        except TimeoutException:
             logging.error(
                 "Failed to insert password. Please ensure that your username is an email address."
             )
             exit(1)
 
         WebDriverWait(driver, 20).until(
-            EC.element_to_be_clickable(
-                (
-                    By.XPATH,
-                    "//button[@type='submit' and @id='login-button']",
-                )
-            )
+            EC.element_to_be_clickable(XPATH_EDUID_SUBMIT_BTN)
         ).click()
 
     def __organisation_login_default(self, driver):
-        driver.find_element(By.XPATH, "//input[@id='username']").send_keys(
-            self.creds[CREDENTIALS_UNAME]
+        username = WebDriverWait(driver, 20).until(
+            EC.presence_of_element_located(XPATH_USERNAME_INPUT)
         )
-        driver.find_element(By.XPATH, "//input[@id='password']").send_keys(
-            self.creds[CREDENTIALS_PW]
+        password = driver.find_element(*XPATH_PASSWORD_INPUT)
+        # fill both fields with a single script call
+        driver.execute_script(
+            "[[arguments[0], arguments[1]], [arguments[2], arguments[3]]].forEach(([e, v]) => {"
+            + "  e.value = v;"
+            + "  e.dispatchEvent(new Event('input', {bubbles: true}));"
+            + "  e.dispatchEvent(new Event('change', {bubbles: true}));"
+            + "});",
+            username,
+            self.creds[CREDENTIALS_UNAME],
+            password,
+            self.creds[CREDENTIALS_PW],
         )
-        driver.find_element(By.XPATH, "//button[@type='submit']").click()
+        driver.find_element(*XPATH_SUBMIT_BTN).click()
 
     def __wait_for_free_places(self, driver):
+        deadline = (
+            time.monotonic() + (self.lesson_start - datetime.today()).total_seconds()
+        )
+        retry_interval_sec = 1 * 30
         while True:
-            num_free_spots_raw = driver.find_element(
-                By.XPATH, "//dl[contains(., 'Freie Plätze')]/dd/span"
-            )
-            num_free_spots = int(num_free_spots_raw.get_attribute("innerHTML"))
-
-            if num_free_spots > 0:
-                # has free places
-                return
-
-            if datetime.today() > self.lesson_start:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
                 raise AsvzBotException(
                     "Stopping enrollment because lesson has started."
                 )
 
-            retry_interval_sec = 1 * 30
-            logging.info(
-                "Lesson is booked out. Rechecking in {} secs..".format(
-                    retry_interval_sec
-                )
-            )
-            time.sleep(retry_interval_sec)
+            try:
+                # the span is briefly empty or replaced while the page re-renders
+                WebDriverWait(
+                    driver,
+                    min(retry_interval_sec, remaining),
+                    ignored_exceptions=(
+                        NoSuchElementException,
+                        StaleElementReferenceException,
+                        ValueError,
+                    ),
+                ).until(lambda d: int(d.find_element(*XPATH_FREE_PLACES).text) > 0)
+                # has free places
+                return
+            except TimeoutException:
+                pass
+
+            logging.info("Lesson is booked out. Reloading and rechecking..")
             driver.refresh()
 
 
+def fast_fill(driver, element, text):
+    """
+    Sets the value of an input field with a single script call instead of sending every key stroke.
+    """
+    driver.execute_script(
+        "arguments[0].value = arguments[1];"
+        + "arguments[0].dispatchEvent(new Event('input', {bubbles: true}));"
+        + "arguments[0].dispatchEvent(new Event('change', {bubbles: true}));",
+        element,
+        text,
+    )
+
+
+def parse_organisation(organisation) -> str:
+    organisation = organisation.upper()
+    return ORGANISATION_ALIASES.get(organisation, organisation)
+
+
+def parse_flag(value) -> bool:
+    return value is not None and value.strip().lower() in ("1", "true", "yes", "on")
+
+
 def parse_and_validate_start_time(start_time) -> datetime:
     try:
         return datetime.strptime(start_time, TIMEFORMAT)
@@ -701,7 +928,96 @@ def parse_and_validate_start_time(start_time) -> datetime:
         raise argparse.ArgumentTypeError(msg)
 
 
+def get_env_defaults() -> dict:
+    """
+    Argument defaults taken from the environment, empty values count as unset.
+    """
+    defaults = {
+        arg: value if value != "" else None
+        for arg, attr in ENV_DEFAULTS
+        for value in (getattr(EnvVariables, attr),)
+    }
+    defaults["save_credentials"] = (
+        EnvVariables.save_credentials
+        if EnvVariables.save_credentials is not None
+        else True
+    )
+    return defaults
+
+
+def has_selenium_manager() -> bool:
+    """
+    Selenium ships its own driver manager since 4.6, which resolves and caches chromedriver locally.
+    """
+    if parse_flag(EnvVariables.disable_selenium_manager):
+        return False
+    version = tuple(int(v) for v in re.findall(r"\d+", selenium.__version__)[:2])
+    return version >= (4, 6)
+
+
 def get_chromedriver_path(proxy_url=None):
+    # Selenium Manager does not use our proxy aware HTTP client, so only rely on it without a proxy
+    if proxy_url is None and has_selenium_manager():
+        logging.debug("Using Selenium Manager to locate chromedriver")
+        return None
+
+    try:
+        with open(CHROMEDRIVER_CACHE_FILENAME, "r") as f:
+            entry = json.load(f)
+        if (
+            time.time() - entry["ts"] < CHROMEDRIVER_CACHE_TTL_SEC
+            and entry["proxy"] == (proxy_url is not None)
+            and entry["platform"] == platform.platform()
+            and entry["chrome_mtime"] == _get_chrome_mtime()
+            and os.access(entry["path"], os.X_OK)
+        ):
+            logging.debug(f"Using cached chromedriver: {entry['path']}")
+            return entry["path"]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    path = _install_chromedriver(proxy_url)
+
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        with open(CHROMEDRIVER_CACHE_FILENAME, "w") as f:
+            json.dump(
+                {
+                    "path": path,
+                    "ts": time.time(),
+                    "proxy": proxy_url is not None,
+                    "platform": platform.platform(),
+                    "chrome_mtime": _get_chrome_mtime(),
+                },
+                f,
+            )
+    except OSError as e:
+        logging.warning(f"Failed to cache chromedriver path: {e}")
+
+    return path
+
+
+def _get_chrome_mtime() -> Optional[float]:
+    """
+    Returns the modification time of the installed Chrome/Chromium binary, which changes on every browser update.
+    """
+    for name in ("google-chrome", "chromium", "chromium-browser"):
+        path = shutil.which(name)
+        if path is not None:
+            return os.path.getmtime(path)
+    return None
+
+
+def resolve_chromedriver_path(proxy_url=None):
+    """
+    Prefers a chromedriver installed on the system and only falls back to detecting one.
+    """
+    if os.access(SYSTEM_CHROMEDRIVER_PATH, os.X_OK):
+        return SYSTEM_CHROMEDRIVER_PATH
+    return get_chromedriver_path(proxy_url)
+
+
+def _install_chromedriver(proxy_url=None):
     if proxy_url is not None:
         logging.info(f"Using proxy: {proxy_url}")
         http_client = CustomHttpClient(proxy=proxy_url)
@@ -736,13 +1052,42 @@ def get_chromedriver_path(proxy_url=None):
     return webdriver_manager.install()
 
 
+# enrollment type -> factory creating the enroller from the parsed arguments
+ENROLLMENT_TYPES = {
+    "lesson": lambda args, creds, chromedriver_path: AsvzEnroller(
+        chromedriver_path,
+        f"{LESSON_BASE_URL}/tn/lessons/{args.lesson_id}",
+        creds,
+        args.proxy,
+    ),
+    "event": lambda args, creds, chromedriver_path: AsvzEnroller(
+        chromedriver_path,
+        f"{LESSON_BASE_URL}/tn/events/{args.event_id}",
+        creds,
+        args.proxy,
+    ),
+    "training": lambda args, creds, chromedriver_path: AsvzEnroller.from_lesson_attributes(
+        chromedriver_path,
+        args.weekday,
+        args.start_time,
+        args.trainer,
+        args.facility,
+        args.level,
+        args.sport_id,
+        args.proxy,
+        creds,
+    ),
+}
+
+
 def main():
     parser = argparse.ArgumentParser()
 
     parser.add_argument(
         "-org",
         "--organisation",
-        choices=list(ORGANISATIONS.keys()),
+        type=parse_organisation,
+        choices=ORG_CHOICES,
         help="Name of your organisation.",
     )
     parser.add_argument(
@@ -794,7 +1139,7 @@ def main():
         "-w",
         "--weekday",
         required=True,
-        choices=list(WEEKDAYS.keys()),
+        choices=WEEKDAY_CHOICES,
         help="Day of the week of the lesson",
     )
 
@@ -816,14 +1161,14 @@ def main():
         "-f",
         "--facility",
         required=True,
-        choices=list(FACILITIES.keys()),
+        choices=FACILITY_CHOICES,
         help="Facility where the lesson takes place e.g. 'Sport Center Polyterrasse'",
     )
     parser_training.add_argument(
         "-l",
         "--level",
         required=False,
-        choices=list(LEVELS.keys()),
+        choices=LEVEL_CHOICES,
         help="Level of the lesson e.g. 'Alle'",
     )
     parser_training.add_argument(
@@ -832,34 +1177,16 @@ def main():
         help="Number at the end of link to a particular sport on ASVZ Sportfahrplan, e.g. 45743 in https://asvz.ch/426-sportfahrplan?f[0]=sport:45743 for volleyball",
     )
 
-    parser.set_defaults(
-        organisation=EnvVariables.cred_organization
-        if EnvVariables.cred_organization != ""
-        else None,
-        username=EnvVariables.cred_username
-        if EnvVariables.cred_username != ""
-        else None,
-        password=EnvVariables.cred_password
-        if EnvVariables.cred_password != ""
-        else None,
-        save_credentials=EnvVariables.save_credentials
-        if EnvVariables.save_credentials is not None
-        else True,
-        type=EnvVariables.enrollment_type
-        if EnvVariables.enrollment_type != ""
-        else None,
-        lesson_id=EnvVariables.lesson_id if EnvVariables.lesson_id != "" else None,
-        weekday=EnvVariables.week_day if EnvVariables.week_day != "" else None,
-        start_time=parse_and_validate_start_time(EnvVariables.start_time)
-        if EnvVariables.start_time is not None
-        else None,
-        trainer=EnvVariables.trainer if EnvVariables.trainer != "" else None,
-        facility=EnvVariables.facility if EnvVariables.sport_id != "" else None,
-        level=EnvVariables.level if EnvVariables.level != "" else None,
-        sport_id=EnvVariables.sport_id if EnvVariables.sport_id != "" else None,
-    )
+    parser.set_defaults(**get_env_defaults())
 
     args = parser.parse_args()
+
+    # A start time from the environment is only parsed when it is actually used
+    if args.type == "training" and isinstance(args.start_time, str):
+        try:
+            args.start_time = parse_and_validate_start_time(args.start_time)
+        except argparse.ArgumentTypeError as e:
+            parser.error(str(e))
     logging.debug(f"Parsed {args=}")
 
     creds = None
@@ -871,32 +1198,15 @@ def main():
         logging.error(e)
         exit(1)
 
-    # chromedriver_path = get_chromedriver_path(args.proxy)
-    chromedriver_path = '/usr/bin/chromedriver'
-
-    enroller = None
-    if args.type == "lesson":
-        lesson_url = "{}/tn/lessons/{}".format(LESSON_BASE_URL, args.lesson_id)
-        enroller = AsvzEnroller(chromedriver_path, lesson_url, creds, args.proxy)
-    elif args.type == "event":
-        lesson_url = "{}/tn/events/{}".format(LESSON_BASE_URL, args.event_id)
-        enroller = AsvzEnroller(chromedriver_path, lesson_url, creds, args.proxy)
-    elif args.type == "training":
-        enroller = AsvzEnroller.from_lesson_attributes(
-            chromedriver_path,
-            args.weekday,
-            args.start_time,
-            args.trainer,
-            args.facility,
-            args.level,
-            args.sport_id,
-            args.proxy,
-            creds,
-        )
-    else:
-        raise AsvzBotException("Unknown enrollment type: '{}".format(args.type))
+    chromedriver_path = resolve_chromedriver_path(args.proxy)
+
+    create_enroller = ENROLLMENT_TYPES.get(args.type)
+    if create_enroller is None:
+        raise AsvzBotException(f"Unknown enrollment type: '{args.type}'")
+    enroller = create_enroller(args, creds, chromedriver_path)
 
-    enroller.enroll()
+    with enroller:
+        enroller.enroll()
 
 
 if __name__ == "__main__":
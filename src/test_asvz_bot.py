@@ -0,0 +1,48 @@
+import pytest
+
+from asvz_bot import (
+    INTERVAL_START_REGEX,
+    EnvVariables,
+    get_env_defaults,
+    parse_flag,
+    parse_organisation,
+)
+
+
+def test_parse_flag():
+    assert all(parse_flag(v) for v in ("1", "true", "True", "yes", " on "))
+    assert not any(parse_flag(v) for v in (None, "", "0", "false", "no", "off"))
+
+
+@pytest.mark.parametrize(
+    "interval, start",
+    [
+        ("Mo, 04.12.2023 10:00 - Di, 26.12.2023 23:59", "04.12.2023 10:00"),
+        ("Mo, 10.05.2021 06:55 - 08:05", "10.05.2021 06:55"),
+        ("  Fr, 1.3.2024 7:30 - 08:30", "1.3.2024 7:30"),
+    ],
+)
+def test_interval_start_regex(interval, start):
+    m = INTERVAL_START_REGEX.match(interval)
+    assert m is not None
+    assert m.group(1) == start
+
+
+def test_interval_start_regex_rejects_missing_weekday():
+    assert INTERVAL_START_REGEX.match("04.12.2023 10:00 - 26.12.2023 23:59") is None
+
+
+@pytest.mark.parametrize(
+    "organisation, expected",
+    [("eth", "ETH"), ("Eth", "ETH"), ("edu-id", "EDUID"), ("switch", "EDUID")],
+)
+def test_parse_organisation(organisation, expected):
+    assert parse_organisation(organisation) == expected
+
+
+def test_env_defaults_facility(monkeypatch):
+    monkeypatch.setattr(EnvVariables, "facility", "Sport Center Irchel")
+    monkeypatch.setattr(EnvVariables, "level", "")
+    defaults = get_env_defaults()
+    assert defaults["facility"] == "Sport Center Irchel"
+    assert defaults["level"] is None